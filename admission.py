@@ -0,0 +1,98 @@
+import asyncio
+import os
+import resource
+from contextlib import asynccontextmanager
+from typing import Optional
+from config import (ADMISSION_INGEST_MAX_IN_FLIGHT, ADMISSION_INGEST_MAX_QUEUED, ADMISSION_INGEST_MAX_RSS_MB,
+                    ADMISSION_QA_MAX_IN_FLIGHT, ADMISSION_QA_MAX_QUEUED, ADMISSION_QA_MAX_RSS_MB,
+                    ADMISSION_QUEUE_TIMEOUT, ADMISSION_RETRY_AFTER)
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class AdmissionRejected(Exception):
+    """Raised when a request is turned away; carries the HTTP status and Retry-After seconds."""
+    def __init__(self, status: int, reason: str, retry_after: int = ADMISSION_RETRY_AFTER):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionLane:
+    """
+    A bounded pool of work units (documents being ingested, questions being answered)
+    with a bounded wait queue in front of it. Requests are rejected straight away when
+    the queue is full or the process is over its RSS limit, and with 503 if they wait
+    longer than the queue timeout.
+    """
+    def __init__(self, name: str, capacity: int, max_queued: int, max_rss_mb: Optional[float] = None,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.name = name
+        self.capacity = capacity
+        self.max_queued = max_queued
+        self.max_rss_mb = max_rss_mb
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._condition = asyncio.Condition()
+
+    def _check_memory(self):
+        if self.max_rss_mb is not None and current_rss_mb() > self.max_rss_mb:
+            raise AdmissionRejected(503, f"Server is low on memory; {self.name} requests are paused.")
+
+    @asynccontextmanager
+    async def slot(self, weight: int = 1):
+        """Hold `weight` units of the lane for the duration of the block."""
+        # A request larger than the whole lane runs on its own rather than never
+        weight = max(1, min(weight, self.capacity))
+        self._check_memory()
+        async with self._condition:
+            fits = self.in_flight + weight <= self.capacity
+            if not fits and self.waiting >= self.max_queued:
+                raise AdmissionRejected(429, f"Too many {self.name} requests queued.")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(
+                    self._condition.wait_for(lambda: self.in_flight + weight <= self.capacity),
+                    self.queue_timeout
+                )
+            except asyncio.TimeoutError:
+                raise AdmissionRejected(503, f"Timed out waiting for {self.name} capacity.")
+            finally:
+                self.waiting -= 1
+            self.in_flight += weight
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_flight -= weight
+                self._condition.notify_all()
+
+    def stats(self) -> dict:
+        return {'in_flight': self.in_flight, 'capacity': self.capacity, 'waiting': self.waiting}
+
+class AdmissionController:
+    """
+    Separate lanes for document ingestion (measured in documents) and question
+    answering (measured in questions), so a burst of new documents can't starve
+    requests against documents that are already loaded, and vice versa.
+    """
+    def __init__(self):
+        self.ingestion = AdmissionLane("ingestion", ADMISSION_INGEST_MAX_IN_FLIGHT,
+                                       ADMISSION_INGEST_MAX_QUEUED, ADMISSION_INGEST_MAX_RSS_MB)
+        self.qa = AdmissionLane("question answering", ADMISSION_QA_MAX_IN_FLIGHT,
+                                ADMISSION_QA_MAX_QUEUED, ADMISSION_QA_MAX_RSS_MB)
+
+    def stats(self) -> dict:
+        return {
+            'rss_mb': round(current_rss_mb(), 1),
+            'ingestion': self.ingestion.stats(),
+            'qa': self.qa.stats(),
+        }
@@ -1,5 +1,7 @@
 from quart import Quart, request, jsonify
 from cag_engine import CAGEngine
+from admission import AdmissionController, AdmissionRejected
+from config import PRELOAD_ON_STARTUP, PRELOAD_DOCUMENTS
 import asyncio
 import functools
 from dotenv import load_dotenv
@@ -10,6 +12,15 @@ load_dotenv()
 app = Quart(__name__)
 
 cag_engine = CAGEngine()
+admission = AdmissionController()
+
+@app.before_serving
+async def preload_documents():
+    """Ingest the hot documents before serving, so no request pays their ingestion cost."""
+    if PRELOAD_ON_STARTUP and PRELOAD_DOCUMENTS:
+        print(f"Preloading {len(PRELOAD_DOCUMENTS)} documents...")
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, cag_engine.preload_documents, PRELOAD_DOCUMENTS)
 
 def validate_bearer_token(f):  
     @functools.wraps(f)
@@ -44,8 +55,24 @@ async def get_answers():
         if not questions or not isinstance(questions, list):
             return jsonify({"error": "A list of questions ('questions') is required"}), 400
         
-        # Await the asynchronous batch generation function
-        answers_list = await cag_engine.generate_batch_answers(questions, document_url)
+        try:
+            # New documents are ingested while holding an ingestion slot; the result stays
+            # in the retriever pool, so a request rejected afterwards is cheap to retry.
+            retriever = cag_engine.get_pooled_retriever(document_url)
+            if retriever is None:
+                async with admission.ingestion.slot():
+                    try:
+                        retriever = await cag_engine.prepare_document(document_url)
+                    except ValueError as e:
+                        # The document couldn't be downloaded or has no extractable text
+                        return jsonify({"error": f"Could not process document: {e}"}), 422
+
+            # Answer against the retriever we hold, so an eviction in between can't
+            # trigger a second ingestion outside the ingestion lane
+            async with admission.qa.slot(weight=len(questions)):
+                answers_list = await cag_engine.generate_batch_answers(questions, retriever=retriever)
+        except AdmissionRejected as e:
+            return jsonify({"error": e.reason}), e.status, {"Retry-After": str(e.retry_after)}
         
         # Format the response
         answers = []
@@ -67,7 +94,7 @@ async def get_answers():
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint to confirm the server is running."""
-    return jsonify({"status": "healthy"}), 200
+    return jsonify({"status": "healthy", "admission": admission.stats()}), 200
 
 def start_app():
     app.run(host='127.0.0.1', port=5000, debug=False, threaded=True)
@@ -0,0 +1,259 @@
+"""
+Benchmarks for the CAG pipeline.
+
+    python benchmark.py planner --document <pdf url> --questions questions.json [--answers]
+    python benchmark.py chunker [--pages 1000] [--pdf file.pdf]
+    python benchmark.py hedging [--distribution tail] [--requests 2000]
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from statistics import mean, median
+
+def _load_questions(path):
+    """Questions as a JSON list or one per line."""
+    with open(path) as f:
+        content = f.read()
+    try:
+        return json.loads(content)
+    except ValueError:
+        return [line.strip() for line in content.splitlines() if line.strip()]
+
+def _token_agreement(a, b):
+    """Jaccard overlap of the word sets of two answers."""
+    tokens_a = set(re.findall(r"\w+", a.lower()))
+    tokens_b = set(re.findall(r"\w+", b.lower()))
+    if not tokens_a and not tokens_b:
+        return 1.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
+def _timed_retrieval(retriever, query, plan):
+    start = time.perf_counter()
+    docs = retriever.retrieve(query, **plan)
+    return docs, time.perf_counter() - start
+
+def benchmark_planner(document_url, questions, with_answers=False):
+    """
+    Compare the fixed full pipeline with the intent-aware planner on the same questions:
+    retrieval latency, overlap of retrieved chunks and, optionally, LLM answer agreement.
+    """
+    from cag_engine import CAGEngine
+    from llm_interface import get_llm_response_with_cache
+
+    engine = CAGEngine()
+    retriever = engine._setup_retriever_for_document(document_url)
+
+    start = time.perf_counter()
+    plans = engine.query_processor.plan_queries(questions)
+    planning_time = time.perf_counter() - start
+
+    rows = []
+    for query, plan in zip(questions, plans):
+        full_docs, full_time = _timed_retrieval(retriever, query, {})
+        planned_docs, planned_time = _timed_retrieval(retriever, query, plan)
+        full_ids = {doc.metadata['chunk_id'] for doc in full_docs}
+        planned_ids = {doc.metadata['chunk_id'] for doc in planned_docs}
+        row = {
+            'query': query,
+            'plan': engine.query_processor.analyze_queries([query])[0]['plan_name'],
+            'full_latency': full_time,
+            'planned_latency': planned_time,
+            'chunk_overlap': len(full_ids & planned_ids) / max(len(planned_ids), 1),
+        }
+        if with_answers:
+            full_answer = get_llm_response_with_cache(query, [{'text_snippet': d.page_content} for d in full_docs])
+            planned_answer = get_llm_response_with_cache(query, [{'text_snippet': d.page_content} for d in planned_docs])
+            row['answer_agreement'] = _token_agreement(full_answer, planned_answer)
+        rows.append(row)
+
+    print(f"Planned {len(questions)} questions in {planning_time * 1000:.1f} ms (batched nlp.pipe)")
+    for name in ('fast', 'standard', 'deep'):
+        group = [row for row in rows if row['plan'] == name]
+        if not group:
+            continue
+        line = (f"{name:>8}: n={len(group):<4} "
+                f"full p50={median(r['full_latency'] for r in group) * 1000:.1f} ms  "
+                f"planned p50={median(r['planned_latency'] for r in group) * 1000:.1f} ms  "
+                f"chunk overlap={mean(r['chunk_overlap'] for r in group):.2f}")
+        if with_answers:
+            line += f"  answer agreement={mean(r['answer_agreement'] for r in group):.2f}"
+        print(line)
+    total_full = sum(row['full_latency'] for row in rows)
+    total_planned = sum(row['planned_latency'] for row in rows) + planning_time
+    print(f"   total: full {total_full:.2f} s, planned {total_planned:.2f} s "
+          f"({(1 - total_planned / total_full) * 100 if total_full else 0:.1f}% saved)")
+    return rows
+
+def _synthetic_pages(num_pages, seed=0):
+    """Policy-like pages: paragraphs of sentences of varying length."""
+    rng = random.Random(seed)
+    vocabulary = ("policy insured coverage claim premium hospital treatment period benefit "
+                  "exclusion waiting sum limit notification document member expense").split()
+    pages = []
+    for _ in range(num_pages):
+        paragraphs = []
+        for _ in range(rng.randint(3, 8)):
+            sentences = [" ".join(rng.choice(vocabulary) for _ in range(rng.randint(6, 30))).capitalize() + "."
+                         for _ in range(rng.randint(2, 8))]
+            paragraphs.append(" ".join(sentences))
+        pages.append("\n\n".join(paragraphs) + "\n")
+    return pages
+
+def benchmark_chunker(pages, repeat=3):
+    """
+    Compare the LangChain RecursiveCharacterTextSplitter setup the pipeline used to
+    run with the native chunker on the same pages.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from chunker import iter_chunks
+    from config import CHUNK_SIZE, CHUNK_OVERLAP
+
+    def langchain_split():
+        # Exactly the old chunk_text: split_text over the concatenated pages, no offsets
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            length_function=len,
+            is_separator_regex=False,
+            separators=["\n\n", "\n", ". ", " ", ""]
+        )
+        return splitter.split_text("".join(pages))
+
+    candidates = [
+        ("langchain", langchain_split),
+        ("native", lambda: [chunk.text for chunk in iter_chunks(pages, CHUNK_SIZE, CHUNK_OVERLAP)]),
+    ]
+
+    print(f"{len(pages)} pages, {sum(len(page) for page in pages):,} characters")
+    baseline = None
+    for name, run in candidates:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            chunks = run()
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        baseline = baseline or best
+        # Characters to embed, which drives ingestion cost far more than chunking time
+        print(f"{name:>12}: {best * 1000:8.1f} ms  {len(chunks):6} chunks  "
+              f"{sum(len(chunk) for chunk in chunks):,} chars  "
+              f"mean length {mean(len(chunk) for chunk in chunks):6.1f}  speedup {baseline / best:5.1f}x")
+
+class FakeGenAIClient:
+    """
+    Stand-in for genai.Client with the same aio.models.generate_content shape.
+    Each call sleeps for a latency drawn from `sample_latency`, then raises the
+    exception returned by `sample_error` (if any), and counts started, completed
+    and cancelled calls.
+    """
+    def __init__(self, sample_latency, sample_error=None):
+        self.sample_latency = sample_latency
+        self.sample_error = sample_error
+        self.started = self.completed = self.cancelled = 0
+        self.aio = self
+        self.models = self
+
+    async def generate_content(self, model=None, contents=None, config=None):
+        self.started += 1
+        latency = self.sample_latency()
+        error = self.sample_error() if self.sample_error else None
+        try:
+            await asyncio.sleep(latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if error is not None:
+            raise error
+        self.completed += 1
+        return type("FakeResponse", (), {"text": f" answer from {model} "})()
+
+LATENCY_DISTRIBUTIONS = {
+    # Mostly fast with a heavy lognormal tail
+    "lognormal": lambda rng: rng.lognormvariate(-4.0, 0.8),
+    # 95% around 20 ms, 5% stragglers at 10-20x that
+    "tail": lambda rng: rng.uniform(0.2, 0.4) if rng.random() < 0.05 else rng.gauss(0.02, 0.004),
+    # No tail: hedging should barely trigger
+    "uniform": lambda rng: rng.uniform(0.015, 0.025),
+}
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def _run_fake_requests(client, hedger, num_requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    def generate():
+        return client.aio.models.generate_content(model="fake-model", contents="prompt")
+
+    async def one_request():
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            if hedger is None:
+                await generate()
+            else:
+                await hedger.run(generate)
+            latencies.append(loop.time() - start)
+
+    await asyncio.gather(*(one_request() for _ in range(num_requests)))
+    return latencies
+
+def benchmark_hedging(distribution="tail", num_requests=2000, concurrency=50, seed=0):
+    """
+    Drive RequestHedger with a fake client under an injected latency distribution
+    and compare tail latency and extra calls against unhedged requests.
+    """
+    from llm_interface import RequestHedger
+
+    sampler = LATENCY_DISTRIBUTIONS[distribution]
+    for name, hedger in (("unhedged", None), ("hedged", RequestHedger())):
+        rng = random.Random(seed)
+        client = FakeGenAIClient(lambda: sampler(rng))
+        latencies = asyncio.run(_run_fake_requests(client, hedger, num_requests, concurrency))
+        line = (f"{name:>9}: p50={_percentile(latencies, 50) * 1000:6.1f} ms  "
+                f"p95={_percentile(latencies, 95) * 1000:6.1f} ms  "
+                f"p99={_percentile(latencies, 99) * 1000:6.1f} ms  "
+                f"calls={client.started} ({client.started / num_requests - 1:+.1%})  "
+                f"cancelled={client.cancelled}")
+        if hedger is not None:
+            line += f"  hedge rate={hedger.hedge_rate():.1%}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="CAG pipeline benchmarks.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    planner = subparsers.add_parser("planner", help="Adaptive retrieval depth vs. the fixed pipeline")
+    planner.add_argument("--document", required=True, help="PDF URL to run the questions against")
+    planner.add_argument("--questions", required=True, help="JSON list or text file of questions")
+    planner.add_argument("--answers", action="store_true", help="Also generate answers and report agreement")
+
+    chunker = subparsers.add_parser("chunker", help="Native chunker vs. the LangChain text splitter")
+    chunker.add_argument("--pages", type=int, default=1000, help="Number of synthetic pages")
+    chunker.add_argument("--pdf", help="Chunk the pages of this local PDF instead of synthetic text")
+
+    hedging = subparsers.add_parser("hedging", help="LLM request hedging against a fake client")
+    hedging.add_argument("--distribution", choices=sorted(LATENCY_DISTRIBUTIONS), default="tail")
+    hedging.add_argument("--requests", type=int, default=2000)
+    hedging.add_argument("--concurrency", type=int, default=50)
+
+    args = parser.parse_args()
+    if args.command == "planner":
+        benchmark_planner(args.document, _load_questions(args.questions), with_answers=args.answers)
+    elif args.command == "chunker":
+        if args.pdf:
+            from data_processor import extract_pages_from_file
+            pages = extract_pages_from_file(args.pdf)
+        else:
+            pages = _synthetic_pages(args.pages)
+        benchmark_chunker(pages)
+    elif args.command == "hedging":
+        benchmark_hedging(args.distribution, num_requests=args.requests, concurrency=args.concurrency)
+
+if __name__ == "__main__":
+    main()
@@ -1,101 +1,327 @@
 import pickle
 import os
+import glob
+import json
+import hashlib
+import argparse
 import time
+import requests
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from cachetools import TTLCache, cached
 from tqdm import tqdm
-from config import CACHE_FILE, LLM_MODEL_NAME, CHUNK_SIZE, GEMINI_API_KEY
-from data_processor import initialize_and_preprocess
+from config import (CACHE_FILE, LLM_MODEL_NAME, CHUNK_SIZE, CHUNK_OVERLAP, GEMINI_API_KEY,
+                    PDF_URLS, CORPUS_CACHE_DIR, CORPUS_BUILD_WORKERS)
+from data_processor import initialize_and_preprocess, extract_pages_from_bytes, chunk_pages
+from chunk_store import ChunkStore
+from chunker import CHUNKER_VERSION
+
+MANIFEST_FILE = "manifest.json"
+# 3.0: entries refer to chunk text by 'store_position' in the cache's 'chunk_store'
+CACHE_VERSION = '3.0'
+
+def content_hash(data):
+    """Stable BLAKE2 digest of text or bytes; unlike hash(), it is identical across runs."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def _upgrade_cache_entries(entries):
+    """
+    Move the text of pre-3.0 entries ('full_text', or only 'text_snippet' in the
+    oldest caches) into a chunk store and point each entry at it by position.
+    """
+    chunk_store = ChunkStore()
+    upgraded = []
+    for entry in entries:
+        entry = dict(entry)
+        text = entry.pop('full_text', None) or entry.get('text_snippet', '')
+        entry.pop('text_snippet', None)
+        entry['store_position'] = chunk_store.add(text, entry.get('source_doc_id', ''),
+                                                  chunk_id=entry.get('chunk_id'), page=entry.get('page', -1))
+        upgraded.append(entry)
+    return upgraded, chunk_store
 
 def load_cache():
-    """Load cache data from disk"""
+    """
+    Load cache data from disk as {'metadata', 'entries', 'chunk_store'}, the entries'
+    text being in the chunk store. Older caches are upgraded to this shape in memory.
+    """
     if not os.path.exists(CACHE_FILE):
         return None
-    
+
     try:
         with open(CACHE_FILE, 'rb') as f:
             cache_data = pickle.load(f)
-        
+
         # Handle both old and new cache formats
         if isinstance(cache_data, dict) and 'entries' in cache_data:
-            # New format with metadata
-            return cache_data['entries']
+            metadata = cache_data.get('metadata', {})
+            if metadata.get('version') == CACHE_VERSION and 'chunk_store' in cache_data:
+                return cache_data
+            entries = cache_data['entries']
         else:
             # Old format - direct list
-            return cache_data
+            metadata, entries = {}, cache_data
+
+        entries, chunk_store = _upgrade_cache_entries(entries)
+        return {'metadata': {**metadata, 'version': CACHE_VERSION}, 'entries': entries, 'chunk_store': chunk_store}
     except Exception as e:
         print(f"Error loading cache: {e}")
         return None
 
+def load_manifest(cache_dir=CORPUS_CACHE_DIR):
+    """Load the corpus manifest, or an empty one if missing or built with other chunk settings."""
+    empty = {'chunk_size': CHUNK_SIZE, 'chunk_overlap': CHUNK_OVERLAP, 'chunker': CHUNKER_VERSION, 'documents': {}}
+    path = os.path.join(cache_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return empty
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error loading corpus manifest: {e}")
+        return empty
+    if any(manifest.get(key) != empty[key] for key in ('chunk_size', 'chunk_overlap', 'chunker')):
+        print("Chunk settings changed since the last corpus build; rebuilding all shards.")
+        return empty
+    return manifest
+
+def _write_atomic(path, data, mode='wb'):
+    """Write to a temp file and rename it, so an interrupted build never leaves a torn file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, mode) as f:
+        if 'b' in mode:
+            pickle.dump(data, f)
+        else:
+            json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+def load_corpus_cache(cache_dir=CORPUS_CACHE_DIR):
+    """Load every shard listed in the corpus manifest, keyed by source."""
+    shards = {}
+    for source, info in load_manifest(cache_dir)['documents'].items():
+        with open(os.path.join(cache_dir, info['shard']), 'rb') as f:
+            shards[source] = pickle.load(f)
+    return shards
+
 def build_cache():
     """Build cache using the advanced cache manager"""
     cache_manager = AdvancedCacheManager()
     cache_manager.build_cache_with_metadata()
 
+def build_corpus_cache(sources=None, workers=CORPUS_BUILD_WORKERS, force=False):
+    """Build the sharded corpus cache using the advanced cache manager"""
+    cache_manager = AdvancedCacheManager()
+    return cache_manager.build_corpus_cache(sources, workers=workers, force=force)
+
+def _fetch_source(source, info):
+    """
+    Read a source document's bytes, along with its HTTP validators for remote sources.
+    Returns None for the bytes when the manifest record `info` is still current: the
+    server answers a conditional GET with 304 Not Modified, or the BLAKE2 digest of
+    the bytes matches the recorded source_hash.
+    """
+    if os.path.isfile(source):
+        with open(source, 'rb') as f:
+            content = f.read()
+        validators = {}
+    else:
+        headers = {}
+        if info and info.get('etag'):
+            headers['If-None-Match'] = info['etag']
+        if info and info.get('last_modified'):
+            headers['If-Modified-Since'] = info['last_modified']
+        response = requests.get(source, headers=headers, timeout=30)
+        if response.status_code == 304:
+            return None, {}
+        response.raise_for_status()
+        content = response.content
+        validators = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+    if info and info.get('source_hash') == content_hash(content):
+        return None, validators
+    return content, validators
+
+def _build_document_shard(source, cache_dir, info=None):
+    """
+    Process-pool worker: fetch one document and, unless the manifest record `info` shows
+    it is unchanged, extract, chunk and score it and write its shard.
+    Returns (manifest record, whether the document was rebuilt).
+    """
+    content, validators = _fetch_source(source, info)
+    if content is None:
+        return {**info, **validators}, False
+
+    pages = extract_pages_from_bytes(content, source)
+    if not pages or not any(pages):
+        raise ValueError(f"Failed to extract text from document: {source}")
+
+    chunk_store = ChunkStore()
+    for i, chunk in enumerate(chunk_pages(pages)):
+        chunk_store.add(chunk.text, source, chunk_id=i, page=chunk.page, start=chunk.start, end=chunk.end)
+
+    record = {'source_hash': content_hash(content), **validators}
+    text_hash = content_hash(chunk_store.buffer)
+    if info and info.get('content_hash') == text_hash:
+        # The file changed but its text didn't (e.g. only PDF metadata); keep the shard
+        return {**info, **record}, False
+
+    entries = [AdvancedCacheManager.make_entry(chunk_store, position) for position in range(len(chunk_store))]
+    shard = {
+        'metadata': {
+            'version': CACHE_VERSION,
+            'source': source,
+            'created_at': datetime.now().isoformat(),
+            'total_chunks': len(entries),
+            'content_hash': text_hash,
+        },
+        'entries': entries,
+        'chunk_store': chunk_store,
+    }
+    shard_name = f"{content_hash(source)}.pkl"
+    _write_atomic(os.path.join(cache_dir, shard_name), shard)
+
+    return {
+        'shard': shard_name,
+        'content_hash': text_hash,
+        'total_chunks': len(entries),
+        'built_at': shard['metadata']['created_at'],
+        **record,
+    }, True
+
 class AdvancedCacheManager:
     def __init__(self, max_size=1000, ttl_hours=24):
         self.memory_cache = TTLCache(maxsize=max_size, ttl=ttl_hours * 3600)
         self.disk_cache_file = CACHE_FILE
-        
+        self.corpus_cache_dir = CORPUS_CACHE_DIR
+
     def load_cache(self):
         """Load cache from disk"""
         return load_cache()
-        
+
+    @classmethod
+    def make_entry(cls, chunk_store, position):
+        """Build the cache entry for one chunk; the text itself stays in the chunk store."""
+        text = chunk_store.text(position)
+        return {
+            'chunk_id': chunk_store.chunk_ids[position],
+            'source_doc_id': chunk_store.source_doc_id(position),
+            'store_position': position,
+            'page': chunk_store.pages[position],
+            'created_at': datetime.now().isoformat(),
+            'access_count': 0,
+            'last_accessed': None,
+            'text_hash': content_hash(text),  # For change detection
+            'quality_score': cls._calculate_quality_score(text),
+            'semantic_keywords': cls._extract_keywords(text),
+            'chunk_size': len(text),
+        }
+
     def build_cache_with_metadata(self):
         """Enhanced cache building with metadata and versioning"""
         print("Building enhanced CAG cache...")
         processed_data = initialize_and_preprocess()
-        chunked_documents = processed_data['chunked_documents']
-
-        cache_data = []
-        for doc_chunk in tqdm(chunked_documents, desc="Preparing Enhanced Cache Entries"):
-            chunk_id = doc_chunk['chunk_id']
-            source_id = doc_chunk['source_doc_id']
-            text = doc_chunk['text']
-            
-            cache_entry = {
-                'chunk_id': chunk_id,
-                'source_doc_id': source_id,
-                'text_snippet': text[:500] + "..." if len(text) > 500 else text,
-                'full_text': text,  # Store full text
-                'created_at': datetime.now().isoformat(),
-                'access_count': 0,
-                'last_accessed': None,
-                'text_hash': hash(text),  # For change detection
-                'quality_score': self._calculate_quality_score(text),
-                'semantic_keywords': self._extract_keywords(text),
-                'chunk_size': len(text),
-            }
-            cache_data.append(cache_entry)
+        chunk_store = processed_data['chunk_store']
+
+        cache_data = [
+            self.make_entry(chunk_store, position)
+            for position in tqdm(range(len(chunk_store)), desc="Preparing Enhanced Cache Entries")
+        ]
 
         # Add cache metadata
         cache_metadata = {
-            'version': '2.0',
+            'version': CACHE_VERSION,
             'created_at': datetime.now().isoformat(),
             'total_chunks': len(cache_data),
             'source_documents': len(set(entry['source_doc_id'] for entry in cache_data))
         }
-        
+
         final_cache = {
             'metadata': cache_metadata,
-            'entries': cache_data
+            'entries': cache_data,
+            'chunk_store': chunk_store
         }
 
         print(f"Enhanced cache building complete. Saving to {self.disk_cache_file}...")
         with open(self.disk_cache_file, 'wb') as f:
             pickle.dump(final_cache, f)
         print("Enhanced cache saved.")
-        
-    def _calculate_quality_score(self, text):
+
+    def build_corpus_cache(self, sources=None, workers=CORPUS_BUILD_WORKERS, force=False):
+        """
+        Build one cache shard per document in a process pool and record them in a manifest.
+        Documents already in the manifest are only rebuilt if they changed, judged by a
+        conditional GET for remote documents and the BLAKE2 digest of their bytes, so an
+        interrupted build resumes where it stopped. Returns the manifest.
+        """
+        sources = list(PDF_URLS if sources is None else sources)
+        os.makedirs(self.corpus_cache_dir, exist_ok=True)
+        manifest_path = os.path.join(self.corpus_cache_dir, MANIFEST_FILE)
+        manifest = load_manifest(self.corpus_cache_dir)
+        if force:
+            manifest['documents'] = {}
+
+        # Every document is fetched, but only new or changed ones are processed
+        known = {}
+        for source in sources:
+            info = manifest['documents'].get(source)
+            if info and os.path.exists(os.path.join(self.corpus_cache_dir, info['shard'])):
+                known[source] = info
+
+        print(f"Building corpus cache: {len(sources) - len(known)} new and {len(known)} known documents "
+              f"to check.")
+        if not sources:
+            return manifest
+
+        rebuilt = 0
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(sources)))) as executor:
+            futures = {
+                executor.submit(_build_document_shard, source, self.corpus_cache_dir, known.get(source)): source
+                for source in sources
+            }
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Building Corpus Shards"):
+                source = futures[future]
+                try:
+                    manifest['documents'][source], changed = future.result()
+                except Exception as e:
+                    # A known document keeps its shard; a new one stays out of the
+                    # manifest, so the next run retries it
+                    print(f"Error building cache shard for {source}: {e}")
+                    continue
+                rebuilt += changed
+                manifest['updated_at'] = datetime.now().isoformat()
+                _write_atomic(manifest_path, manifest, mode='w')
+
+        print(f"Corpus cache saved to {self.corpus_cache_dir}: {rebuilt} of {len(sources)} documents rebuilt.")
+        return manifest
+
+    @staticmethod
+    def _calculate_quality_score(text):
         """Calculate text quality score for prioritization"""
         # Simple heuristic - can be enhanced
         score = 0
         score += len(text.split()) / 100  # Word count factor
         score += text.count('.') / 10     # Sentence count factor
         return min(score, 1.0)
-        
-    def _extract_keywords(self, text):
+
+    @staticmethod
+    def _extract_keywords(text):
         """Extract key terms for better indexing"""
         # Simple keyword extraction - enhance with NLP libraries
         words = text.lower().split()
         return [word for word in words if len(word) > 5][:10]
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the sharded CAG corpus cache.")
+    parser.add_argument("--dir", help="Directory of PDF files to ingest instead of config.PDF_URLS")
+    parser.add_argument("--workers", type=int, default=CORPUS_BUILD_WORKERS, help="Number of worker processes")
+    parser.add_argument("--force", action="store_true", help="Rebuild every document, ignoring the manifest")
+    args = parser.parse_args()
+
+    sources = None
+    if args.dir:
+        sources = sorted(os.path.abspath(path) for path in glob.glob(os.path.join(args.dir, "*.pdf")))
+    build_corpus_cache(sources, workers=args.workers, force=args.force)
+
+if __name__ == "__main__":
+    main()
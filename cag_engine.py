@@ -1,11 +1,22 @@
 import os
 from cache_builder import AdvancedCacheManager
-from retriever import CAGHybridRetriever
+from retriever import CAGHybridRetriever, load_reranker
 from llm_interface import get_llm_response_with_cache, get_llm_response_async
 from query_processor import QueryProcessor
-from data_processor import process_new_document
+from data_processor import process_new_document, is_cache_valid, schedule_document_refresh
+from config import USE_QUERY_PLANNER, RETRIEVER_POOL_SIZE, EMBEDDING_MODEL_NAME
+from langchain_huggingface import HuggingFaceEmbeddings
+from cachetools import LRUCache
 from typing import Optional
 import asyncio
+import functools
+import threading
+
+def _processed_after(a: CAGHybridRetriever, b: CAGHybridRetriever) -> bool:
+    """Whether a was built from a more recent ingestion than b; unknown times count as oldest."""
+    if a.processed_at is None:
+        return False
+    return b.processed_at is None or a.processed_at > b.processed_at
 
 class CAGEngine:
     def __init__(self):
@@ -14,75 +25,184 @@ class CAGEngine:
         """
         self.cache_manager = AdvancedCacheManager()
         self.query_processor = QueryProcessor()
-        self.processed_data: Optional[dict] = None
-        self.retriever: Optional[CAGHybridRetriever] = None
+        # One copy of each model, shared by every pooled retriever and by ingestion
+        self.embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+        self.reranker = load_reranker()
+        # Ready-to-use retrievers keyed by document URL, most recently used kept
+        self.retriever_pool: LRUCache = LRUCache(maxsize=RETRIEVER_POOL_SIZE)
+        self._pool_lock = threading.Lock()
+        # One lock per document URL, so concurrent requests ingest a document only once
+        self._document_locks: dict[str, threading.Lock] = {}
         print("CAG Engine initialized successfully in standby mode.")
 
-    def _setup_retriever_for_document(self, document_url: str):
+    def _setup_retriever_for_document(self, document_url: str) -> CAGHybridRetriever:
         """
-        Sets up the retriever for a specific document, processing it if not already cached.
+        Returns the retriever for a specific document, processing it if not already cached.
         """
-        if not self.processed_data or self.processed_data.get('full_documents', [{}])[0].get('id') != document_url:
-            print(f"Setting up retriever for new document: {document_url}")
-            self.processed_data = process_new_document(document_url)
-            self.retriever = CAGHybridRetriever(self.processed_data)
-        else:
-            print(f"Using existing retriever for document: {document_url}")
+        retriever = self.get_pooled_retriever(document_url)
+        if retriever is not None:
+            return retriever
+
+        with self._pool_lock:
+            document_lock = self._document_locks.setdefault(document_url, threading.Lock())
+        try:
+            with document_lock:
+                # Another request may have finished setting it up while we waited
+                with self._pool_lock:
+                    retriever = self.retriever_pool.get(document_url)
+                if retriever is not None:
+                    return retriever
+
+                print(f"Setting up retriever for new document: {document_url}")
+                # A stale copy is refreshed only once its retriever is pooled, so the refresh
+                # can neither delete its index before it loads nor be overwritten by it
+                processed_data = process_new_document(document_url, embeddings=self.embeddings,
+                                                      refresh_stale=False)
+                retriever = self._pool_retriever(document_url, self._build_retriever(processed_data))
+        finally:
+            # Failed URLs too: they are client-supplied, so locks must not pile up
+            with self._pool_lock:
+                self._document_locks.pop(document_url, None)
+        self._refresh_if_stale(document_url, retriever)
+        return retriever
+
+    def _build_retriever(self, processed_data: dict) -> CAGHybridRetriever:
+        return CAGHybridRetriever(processed_data, embeddings=self.embeddings, reranker=self.reranker)
+
+    def get_pooled_retriever(self, document_url: str) -> Optional[CAGHybridRetriever]:
+        """
+        Returns the document's retriever if it is already in the pool, without ingesting;
+        None means the caller has to prepare the document first.
+        """
+        with self._pool_lock:
+            retriever: Optional[CAGHybridRetriever] = self.retriever_pool.get(document_url)
+        if retriever is None:
+            return None
+        print(f"Using existing retriever for document: {document_url}")
+        self._refresh_if_stale(document_url, retriever)
+        return retriever
+
+    def _refresh_if_stale(self, document_url: str, retriever: CAGHybridRetriever):
+        """
+        Stale-while-revalidate: keep serving a stale pooled retriever and swap in a
+        fresh one when the background refresh lands.
+        """
+        if not is_cache_valid(retriever.processed_at):
+            schedule_document_refresh(document_url, retriever.annoy_index_file,
+                                      self._on_document_refreshed, self.embeddings)
+
+    def _pool_retriever(self, document_url: str, retriever: CAGHybridRetriever) -> CAGHybridRetriever:
+        """
+        Puts a retriever in the pool unless the pool already holds a newer one for the
+        document, and returns whichever is pooled.
+        """
+        with self._pool_lock:
+            pooled: Optional[CAGHybridRetriever] = self.retriever_pool.get(document_url)
+            if pooled is not None and _processed_after(pooled, retriever):
+                return pooled
+            self.retriever_pool[document_url] = retriever
+            return retriever
+
+    async def prepare_document(self, document_url: str) -> CAGHybridRetriever:
+        """Sets up the document's retriever in a worker thread, off the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._setup_retriever_for_document, document_url)
+
+    def _on_document_refreshed(self, document_url: str, processed_data: dict):
+        """
+        Called from the background refresh pool: build the new retriever off the request
+        path, then swap it in so requests keep using the stale one until it is ready.
+        """
+        self._pool_retriever(document_url, self._build_retriever(processed_data))
+
+    def preload_documents(self, document_urls: list[str]):
+        """
+        Ingests documents and builds their retrievers ahead of time, e.g. at server startup.
+        Failures are reported and skipped so one bad URL doesn't block the rest.
+        """
+        for document_url in document_urls:
+            try:
+                self._setup_retriever_for_document(document_url)
+            except Exception as e:
+                print(f"Error preloading document {document_url}: {e}")
+
+    def _plan_queries(self, queries: list[str]) -> list[dict]:
+        """
+        Returns the retriever arguments (depth, rerank, context size) for each query.
+        With the planner disabled every query gets the retriever defaults.
+        """
+        if not USE_QUERY_PLANNER:
+            return [{} for _ in queries]
+        return self.query_processor.plan_queries(queries)
 
     def generate_answer(self, query: str, document_url: str):
         """
         Generates a single answer synchronously.
         """
-        self._setup_retriever_for_document(document_url)
-        if self.retriever is None:
+        retriever = self._setup_retriever_for_document(document_url)
+        if retriever is None:
             raise ValueError("Retriever could not be initialized.")
-        relevant_docs = self.retriever.retrieve(query)
+        plan = self._plan_queries([query])[0]
+        relevant_docs = retriever.retrieve(query, **plan)
         relevant_entries = [{'text_snippet': doc.page_content} for doc in relevant_docs]
         return get_llm_response_with_cache(query, relevant_entries)
 
-    async def generate_batch_answers(self, queries: list[str], document_url: str):
+    async def generate_batch_answers(self, queries: list[str], document_url: Optional[str] = None,
+                                     retriever: Optional[CAGHybridRetriever] = None, with_status: bool = False):
         """
         Asynchronously generates answers for a batch of queries.
         It runs both the document retrieval and LLM calls for all questions concurrently.
+        Pass the retriever from prepare_document to skip looking the document up again.
+        Returns one answer string per query, or with with_status one
+        {'answer': ..., 'status': 'ok' | 'error'} dict per query, where a failed
+        query's answer is its error message.
         """
         try:
-            self._setup_retriever_for_document(document_url)
-            if self.retriever is None:
+            if retriever is None:
+                retriever = await self.prepare_document(document_url)
+            if retriever is None:
                 raise ValueError("Retriever could not be initialized.")
 
+            # Plan the whole batch up front; spaCy processes the questions together
+            loop = asyncio.get_running_loop()
+            plans = await loop.run_in_executor(None, self._plan_queries, queries)
+
             # Helper function to run sync retrieval in a thread, then call the async LLM
-            async def retrieve_and_generate(query: str):
+            async def retrieve_and_generate(query: str, plan: dict):
                 try:
-                    # Get the current running event loop
-                    loop = asyncio.get_running_loop()
-                    
-                    # Run the synchronous self.retriever.retrieve method in the default
+                    # Run the synchronous retriever.retrieve method in the default
                     # thread pool executor. This prevents it from blocking the event loop.
                     relevant_docs = await loop.run_in_executor(
-                        None, self.retriever.retrieve, query
+                        None, functools.partial(retriever.retrieve, query, **plan)
                     )
 
                     relevant_entries = [
                         {'text_snippet': doc.page_content, 'chunk_id': doc.metadata.get('chunk_id'), 'source_doc_id': doc.metadata.get('source_doc_id')}
                         for doc in relevant_docs
                     ]
-                    
-                    # Now that we have the retrieved data, call the async LLM function
-                    response = await get_llm_response_async(query, relevant_entries)
-                    return response
                 except Exception as e:
                     error_message = f"Error processing query '{query}': {e}"
                     print(error_message)
-                    return error_message
+                    return {'answer': error_message, 'status': 'error'}
+
+                try:
+                    # Now that we have the retrieved data, call the async LLM function
+                    response = await get_llm_response_async(query, relevant_entries, raise_errors=True)
+                    return {'answer': response, 'status': 'ok'}
+                except Exception as e:
+                    return {'answer': f"Error during generation: {e}", 'status': 'error'}
 
             # Create a list of tasks for the entire process (retrieve + generate)
-            tasks = [retrieve_and_generate(query) for query in queries]
+            tasks = [retrieve_and_generate(query, plan) for query, plan in zip(queries, plans)]
 
             # Execute all tasks concurrently and wait for all to complete
             responses = await asyncio.gather(*tasks)
-            return responses
 
         except Exception as e:
             batch_error_message = f"Error in batch processing setup: {e}"
             print(batch_error_message)
-            return [batch_error_message] * len(queries)
+            responses = [{'answer': batch_error_message, 'status': 'error'} for _ in queries]
+
+        if with_status:
+            return responses
+        return [response['answer'] for response in responses]
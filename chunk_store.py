@@ -0,0 +1,103 @@
+from array import array
+from typing import Iterable, Iterator, List, Optional
+
+
+class ChunkStore:
+    """
+    Columnar storage for document chunks.
+    All chunk text lives in one contiguous UTF-8 buffer addressed by offset/length
+    arrays, and the per-chunk metadata (chunk_id, page, source) is kept in typed
+    arrays, along with each chunk's character span in the source document.
+    Retrievers work with integer positions into the store and only decode
+    the text of the chunks they actually return.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offsets = array('q')
+        self.lengths = array('q')
+        self.chunk_ids = array('q')
+        self.pages = array('l')
+        self.char_starts = array('q')
+        self.char_ends = array('q')
+        self.source_idx = array('l')
+        self.sources: List[str] = []
+        self._source_lookup = {}
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict]) -> "ChunkStore":
+        """Build a store from the legacy list of chunk dicts ({'chunk_id', 'source_doc_id', 'text'})."""
+        store = cls()
+        for record in records:
+            store.add(
+                record['text'],
+                record['source_doc_id'],
+                chunk_id=record.get('chunk_id'),
+                page=record.get('page', -1),
+                start=record.get('start', -1),
+                end=record.get('end', -1),
+            )
+        return store
+
+    def add(self, text: str, source_doc_id: str, chunk_id: Optional[int] = None, page: int = -1,
+            start: int = -1, end: int = -1) -> int:
+        """Append a chunk and return its position in the store."""
+        encoded = text.encode('utf-8')
+        position = len(self.offsets)
+
+        source = self._source_lookup.get(source_doc_id)
+        if source is None:
+            source = len(self.sources)
+            self.sources.append(source_doc_id)
+            self._source_lookup[source_doc_id] = source
+
+        self.offsets.append(len(self.buffer))
+        self.lengths.append(len(encoded))
+        self.chunk_ids.append(position if chunk_id is None else chunk_id)
+        self.pages.append(page)
+        self.char_starts.append(start)
+        self.char_ends.append(end)
+        self.source_idx.append(source)
+        self.buffer += encoded
+        return position
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def text(self, position: int) -> str:
+        """Decode the text of a single chunk."""
+        start = self.offsets[position]
+        return self.buffer[start:start + self.lengths[position]].decode('utf-8')
+
+    def texts(self, positions: Iterable[int]) -> List[str]:
+        return [self.text(position) for position in positions]
+
+    def iter_texts(self) -> Iterator[str]:
+        for position in range(len(self)):
+            yield self.text(position)
+
+    def source_doc_id(self, position: int) -> str:
+        return self.sources[self.source_idx[position]]
+
+    def metadata(self, position: int) -> dict:
+        return {
+            'chunk_id': self.chunk_ids[position],
+            'source_doc_id': self.source_doc_id(position),
+            'page': self.pages[position],
+            'start': self.char_starts[position],
+            'end': self.char_ends[position],
+        }
+
+    def __getstate__(self):
+        # The lookup table is derived from `sources`; don't pickle it twice.
+        state = self.__dict__.copy()
+        del state['_source_lookup']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Stores pickled before offsets were recorded
+        for name in ('char_starts', 'char_ends'):
+            if name not in state:
+                setattr(self, name, array('q', [-1]) * len(self.offsets))
+        self._source_lookup = {source: i for i, source in enumerate(self.sources)}
@@ -0,0 +1,102 @@
+from bisect import bisect_right
+from collections import namedtuple
+from typing import Iterable, Iterator, List
+
+# Bumped whenever chunk boundaries change, so persisted chunk caches can be invalidated
+CHUNKER_VERSION = 2
+
+# start/end are character offsets into the concatenated page text; page is 1-based
+Chunk = namedtuple('Chunk', ['text', 'start', 'end', 'page'])
+
+# Same preference order as the RecursiveCharacterTextSplitter setup this replaces
+SEPARATORS = ("\n\n", "\n", ". ", " ")
+_WHITESPACE = " \t\n\r\f\v"
+
+def iter_chunks(pages: Iterable[str], chunk_size: int, overlap: int) -> Iterator[Chunk]:
+    """
+    Single-pass chunker over a stream of page texts.
+    Each chunk is at most chunk_size characters and ends on the highest-priority
+    separator available in its window, past the end of the previous chunk. As with
+    the text splitter this replaces, the overlap is made of whole pieces: the next
+    chunk repeats the pieces, at the separator the chunk was cut on, that fit within
+    overlap characters, possibly none. Only a chunk cut mid-word (no separator in its
+    window) overlaps by exactly overlap characters.
+    Pages are buffered only as far as the current window needs, and every character
+    is scanned and copied a bounded number of times, so the cost is linear in the
+    document length whether it arrives as many pages or as one string.
+    """
+    if overlap >= chunk_size:
+        raise ValueError(f"Chunk overlap ({overlap}) must be smaller than chunk size ({chunk_size}).")
+
+    pages = iter(pages)
+    page_starts: List[int] = []
+    buffer = ""
+    base = 0        # offset of buffer[0] in the full text
+    start = 0
+    previous_end = 0
+    exhausted = False
+
+    while True:
+        # Make sure the window plus one character is buffered, so we know whether text follows it
+        while not exhausted and base + len(buffer) <= start + chunk_size:
+            page = next(pages, None)
+            if page is None:
+                exhausted = True
+                break
+            page_starts.append(base + len(buffer))
+            buffer += page
+
+        text_end = base + len(buffer)
+        if start >= text_end:
+            return
+
+        lo = start - base
+        limit = min(start + chunk_size, text_end) - base
+        cut_separator = None
+        if limit + base == text_end:
+            cut = limit
+        else:
+            cut = -1
+            # Split on the last separator that still adds text beyond the previous chunk
+            new_text_from = max(lo, previous_end - base) + 1
+            for separator in SEPARATORS:
+                found = buffer.rfind(separator, new_text_from, limit - len(separator) + 1)
+                if found != -1:
+                    cut = found + len(separator)
+                    cut_separator = separator
+                    break
+            if cut == -1:
+                cut = limit
+
+        # Trim surrounding whitespace, keeping offsets in step with the text
+        chunk_lo, chunk_hi = lo, cut
+        while chunk_lo < chunk_hi and buffer[chunk_lo] in _WHITESPACE:
+            chunk_lo += 1
+        while chunk_hi > chunk_lo and buffer[chunk_hi - 1] in _WHITESPACE:
+            chunk_hi -= 1
+        if chunk_hi > chunk_lo:
+            chunk_start = base + chunk_lo
+            yield Chunk(buffer[chunk_lo:chunk_hi], chunk_start, base + chunk_hi,
+                        bisect_right(page_starts, chunk_start))
+
+        if cut + base == text_end and exhausted:
+            return
+
+        # Start the next chunk after the earliest separator of the same kind within
+        # the overlap, so only whole pieces are repeated; without one, don't overlap
+        overlap_lo = max(cut - overlap, lo + 1)
+        if cut_separator is None:
+            next_lo = overlap_lo
+        else:
+            found = buffer.find(cut_separator, overlap_lo, cut - len(cut_separator))
+            next_lo = found + len(cut_separator) if found != -1 else cut
+        previous_end = base + cut
+        start = base + next_lo
+
+        # Drop text that no later chunk can reach. Only compact once the consumed prefix
+        # outgrows what is left, so each character is copied a bounded number of times
+        # even when a single page holds the whole document.
+        consumed = start - base
+        if consumed > chunk_size and consumed >= len(buffer) - consumed:
+            buffer = buffer[consumed:]
+            base = start
@@ -12,13 +12,23 @@ load_dotenv()
 PERSISTENCE_FILE = "processed_data.pkl" # Stores processed text, vectorizers, etc.
 CACHE_FILE = "cag_cache.pkl"           # Stores the pre-computed KV caches (conceptual for HF)
 DOCUMENT_CACHE_FILE = "document_cache.pkl"  # Stores downloaded and processed documents
-ANNOY_INDEX_FILE = "annoy.index"
+ANNOY_INDEX_DIR = "annoy_indexes"      # One Annoy index file per processed document
+CORPUS_CACHE_DIR = "corpus_cache"      # Per-document cache shards plus manifest.json
+CORPUS_BUILD_WORKERS = os.cpu_count() or 1
 
 # --- Add the URLs to your documents here ---
 PDF_URLS = [
     # Add more PDF URLs as needed
 ]
 
+# --- Document preloading & refresh ---
+# Documents ingested into the retriever pool at server startup; a comma-separated
+# PRELOAD_DOCUMENTS env var overrides the default of PDF_URLS.
+PRELOAD_ON_STARTUP = True
+PRELOAD_DOCUMENTS = [url for url in os.getenv("PRELOAD_DOCUMENTS", "").split(",") if url] or PDF_URLS
+RETRIEVER_POOL_SIZE = max(8, len(PRELOAD_DOCUMENTS))
+DOCUMENT_REFRESH_WORKERS = 2  # Background re-ingestion of stale cached documents
+
 # --- Model Configuration ---
 LLM_MODEL_NAME = "gemini-2.5-flash"
 EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
@@ -27,6 +37,32 @@ EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 CHUNK_SIZE = 1024
 CHUNK_OVERLAP = 212
 
+# --- Admission control for /hackrx/run ---
+# Ingestion is bounded in documents, question answering in questions. Requests
+# beyond the queue get 429, requests over the RSS limit or queue timeout get 503.
+ADMISSION_INGEST_MAX_IN_FLIGHT = 2
+ADMISSION_INGEST_MAX_QUEUED = 4
+ADMISSION_INGEST_MAX_RSS_MB = 3072
+ADMISSION_QA_MAX_IN_FLIGHT = 64
+ADMISSION_QA_MAX_QUEUED = 16
+ADMISSION_QA_MAX_RSS_MB = 4096
+ADMISSION_QUEUE_TIMEOUT = 30  # Seconds a request may wait for capacity
+ADMISSION_RETRY_AFTER = 10    # Seconds, sent as Retry-After on rejection
+
+# --- Offline bulk Q&A (main.py --bulk) ---
+BULK_CONCURRENCY = 2   # Documents processed at once
+BULK_BATCH_SIZE = 32   # Questions per generate_batch_answers call
+
+# --- LLM request hedging ---
+# A call still running after the LLM_HEDGE_PERCENTILE latency of the last
+# LLM_HEDGE_WINDOW calls gets a duplicate request; the first answer wins.
+# At most LLM_HEDGE_MAX_RATE of calls are hedged to bound the extra cost.
+LLM_HEDGING_ENABLED = False
+LLM_HEDGE_PERCENTILE = 95
+LLM_HEDGE_MAX_RATE = 0.1
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_HEDGE_WINDOW = 200
+
 # --- Gemini API Key (Loaded from .env) ---
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
@@ -35,3 +71,15 @@ if not GEMINI_API_KEY:
 USE_LANGCHAIN_HYBRID = True
 BM25_WEIGHT = 0.7
 HYBRID_TOP_K = 5
+
+# --- Adaptive retrieval (query planner) ---
+# QueryProcessor picks one of these profiles per query from its intent and shape.
+# expand_keywords adds the query's entities/lemmas (not already in it) to the BM25 query.
+# Off until `python benchmark.py planner --answers` shows the fast profile keeps answer
+# agreement with the full pipeline on real question sets.
+USE_QUERY_PLANNER = False
+RETRIEVAL_PLANS = {
+    'fast': {'bm25_k': 5, 'annoy_k': 5, 'rerank': False, 'top_k': 3, 'expand_keywords': False},   # simple factoid lookups
+    'standard': {'bm25_k': 10, 'annoy_k': 10, 'rerank': True, 'top_k': 5, 'expand_keywords': False},
+    'deep': {'bm25_k': 15, 'annoy_k': 15, 'rerank': True, 'top_k': 7, 'expand_keywords': True},   # coverage/exclusion questions
+}
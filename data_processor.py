@@ -7,21 +7,34 @@ import pickle
 import os
 import requests
 import fitz
-from config import PERSISTENCE_FILE, CHUNK_SIZE, CHUNK_OVERLAP, DOCUMENT_CACHE_FILE, EMBEDDING_MODEL_NAME, ANNOY_INDEX_FILE
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import (PERSISTENCE_FILE, CHUNK_SIZE, CHUNK_OVERLAP, DOCUMENT_CACHE_FILE, EMBEDDING_MODEL_NAME,
+                    ANNOY_INDEX_DIR, DOCUMENT_REFRESH_WORKERS)
 from tqdm import tqdm
 import re
 from datetime import datetime, timedelta
-from langchain_community.vectorstores import Annoy
+from annoy import AnnoyIndex
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from chunk_store import ChunkStore
+from chunker import iter_chunks
 
 # --- Download NLTK data (only need to do this once) ---
 nltk.download('punkt_tab', quiet=True)
 nltk.download('stopwords', quiet=True)
 nltk.download('wordnet', quiet=True)
 
-# Document cache with expiration (7 days)
+# Document cache with expiration (7 days). Expired entries are still served while a
+# background refresh runs (stale-while-revalidate), up to the maximum staleness.
 DOCUMENT_CACHE_EXPIRY = timedelta(days=7)
+DOCUMENT_CACHE_MAX_STALENESS = timedelta(days=30)
+
+# Guards the load-modify-save cycle on the document cache file, which background
+# refreshes run concurrently with request handling.
+_document_cache_lock = threading.RLock()
+_refresh_executor = None
+_refreshing = set()
 
 def load_document_cache():
     """Load document cache from disk"""
@@ -54,42 +67,60 @@ def is_cache_valid(timestamp):
         return datetime.now() - timestamp < DOCUMENT_CACHE_EXPIRY
     return False
 
+def is_cache_servable(timestamp):
+    """Check if a (possibly expired) cache entry may still be served while it is refreshed"""
+    if isinstance(timestamp, datetime):
+        return datetime.now() - timestamp < DOCUMENT_CACHE_MAX_STALENESS
+    return False
+
+def lookup_cached_document(url):
+    """
+    Retrieve document from cache, allowing stale entries.
+    Returns (data, is_stale), or (None, False) if there is no servable entry.
+    """
+    with _document_cache_lock:
+        cache = load_document_cache()
+        # Ensure cache has the correct structure
+        if not isinstance(cache, dict) or 'documents' not in cache or not isinstance(cache['documents'], dict):
+            return None, False
+
+        documents = cache['documents']
+        if url in documents:
+            doc_entry = documents[url]
+            if isinstance(doc_entry, dict) and 'timestamp' in doc_entry and 'data' in doc_entry:
+                if is_cache_servable(doc_entry['timestamp']) and 'chunk_store' in doc_entry['data']:
+                    print(f"Using cached document for {url}")
+                    # Entries cached before processed_at was recorded carry it only as the timestamp
+                    doc_entry['data'].setdefault('processed_at', doc_entry['timestamp'])
+                    return doc_entry['data'], not is_cache_valid(doc_entry['timestamp'])
+                else:
+                    # Remove too-stale (or pre-chunk-store format) entry
+                    del documents[url]
+                    cache['last_updated'] = datetime.now()
+                    save_document_cache(cache)
+    return None, False
+
 def get_cached_document(url):
     """Retrieve document from cache if available and valid"""
-    cache = load_document_cache()
-    # Ensure cache has the correct structure
-    if not isinstance(cache, dict) or 'documents' not in cache or not isinstance(cache['documents'], dict):
-        return None
-        
-    documents = cache['documents']
-    if url in documents:
-        doc_entry = documents[url]
-        if isinstance(doc_entry, dict) and 'timestamp' in doc_entry and 'data' in doc_entry:
-            if is_cache_valid(doc_entry['timestamp']):
-                print(f"Using cached document for {url}")
-                return doc_entry['data']
-            else:
-                # Remove expired entry
-                del documents[url]
-                cache['last_updated'] = datetime.now()
-                save_document_cache(cache)
-    return None
+    data, is_stale = lookup_cached_document(url)
+    return None if is_stale else data
 
 def cache_document(url, data):
     """Cache processed document"""
-    cache = load_document_cache()
-    # Ensure cache has the correct structure
-    if not isinstance(cache, dict):
-        cache = {'documents': {}, 'last_updated': datetime.now()}
-    if 'documents' not in cache or not isinstance(cache['documents'], dict):
-        cache['documents'] = {}
-        
-    cache['documents'][url] = {
-        'data': data,
-        'timestamp': datetime.now()
-    }
-    cache['last_updated'] = datetime.now()
-    save_document_cache(cache)
+    with _document_cache_lock:
+        cache = load_document_cache()
+        # Ensure cache has the correct structure
+        if not isinstance(cache, dict):
+            cache = {'documents': {}, 'last_updated': datetime.now()}
+        if 'documents' not in cache or not isinstance(cache['documents'], dict):
+            cache['documents'] = {}
+
+        cache['documents'][url] = {
+            'data': data,
+            'timestamp': datetime.now()
+        }
+        cache['last_updated'] = datetime.now()
+        save_document_cache(cache)
 
 def preprocess(text):
     """Cleans, tokenizes, removes stop words, and lemmatizes text."""
@@ -104,77 +135,110 @@ def preprocess(text):
     ]
     return filtered_tokens
 
-def download_and_extract_text(url):
-    """Downloads a PDF from a URL and extracts its text content."""
+def download_and_extract_pages(url):
+    """Downloads a PDF from a URL and extracts the text content of each page."""
     try:
         response = requests.get(url, stream=True, timeout=30)
         response.raise_for_status()
-        with fitz.open(stream=response.content, filetype="pdf") as doc:
-            text_chunks = [page.get_text() for page in doc]
-            text = "".join(text_chunks)
-        return text
     except requests.exceptions.RequestException as e:
         print(f"Error downloading {url}: {e}")
         return None
+    return extract_pages_from_bytes(response.content, url)
+
+def extract_pages_from_bytes(content, source=""):
+    """Extracts the text content of each page of a PDF held in memory."""
+    try:
+        with fitz.open(stream=content, filetype="pdf") as doc:
+            return [page.get_text() for page in doc]
+    except Exception as e:
+        print(f"Error processing PDF from {source}: {e}")
+        return None
+
+def extract_pages_from_file(path):
+    """Extracts the text content of each page of a local PDF file."""
+    try:
+        with fitz.open(path) as doc:
+            return [page.get_text() for page in doc]
     except Exception as e:
-        print(f"Error processing PDF from {url}: {e}")
+        print(f"Error processing PDF from {path}: {e}")
         return None
 
-def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    """Chunks text using a recursive character text splitter."""
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=overlap,
-        length_function=len,
-        is_separator_regex=False,
-        separators=["\n\n", "\n", ". ", " ", ""]
-    )
-    return text_splitter.split_text(text)
+def extract_pages(source):
+    """Extracts page texts from either a local PDF path or a PDF URL."""
+    if os.path.isfile(source):
+        return extract_pages_from_file(source)
+    return download_and_extract_pages(source)
+
+def chunk_pages(pages, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Chunks the page texts as one stream, yielding Chunk(text, start, end, page) with
+    character offsets into the concatenated text and the 1-based page each chunk starts on.
+    """
+    yield from iter_chunks(pages, chunk_size, overlap)
+
+def annoy_index_path(document_url, chunk_store):
+    """
+    Per-document, per-version Annoy index path, so cached documents never share an index
+    file and a refreshed document never overwrites the index of the copy still being served.
+    """
+    digest = hashlib.blake2b(document_url.encode('utf-8'), digest_size=16).hexdigest()
+    version = hashlib.blake2b(chunk_store.buffer, digest_size=8).hexdigest()
+    return os.path.join(ANNOY_INDEX_DIR, f"{digest}-{version}.ann")
+
+def build_annoy_index(texts, index_file, embeddings=None, n_trees=100):
+    """
+    Embeds the texts and writes an Annoy index whose item ids are their positions.
+    Returns the embedding dimension, which is needed to load the index again.
+    """
+    if embeddings is None:
+        embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+    vectors = embeddings.embed_documents(texts)
+    dim = len(vectors[0])
+    index = AnnoyIndex(dim, "angular")
+    for i, vector in enumerate(vectors):
+        index.add_item(i, vector)
+    index.build(n_trees)
+    os.makedirs(os.path.dirname(index_file) or ".", exist_ok=True)
+    # Save beside the target and rename, so a reader never sees a partial index
+    tmp_file = f"{index_file}.tmp"
+    index.save(tmp_file)
+    os.replace(tmp_file, index_file)
+    return dim
 
 def make_langchain_compatible(data):
     """Convert existing data format to work with LangChain"""
-    # Add any necessary format conversions here
+    # Older data kept chunks as a list of dicts; move them into a chunk store
+    if 'chunk_store' not in data and 'chunked_documents' in data:
+        data['chunk_store'] = ChunkStore.from_records(data.pop('chunked_documents'))
+    data.pop('full_documents', None)
     data['langchain_compatible'] = True
     return data
 
-def process_new_document(document_url):
-    """Process a new document URL for immediate use"""
-    print(f"Processing new document: {document_url}")
-    
-    # Check cache first
-    cached_data = get_cached_document(document_url)
-    if cached_data:
-        print(f"Loaded processed document from cache: {document_url}")
-        return cached_data
-    
-    # Download and extract text
-    text = download_and_extract_text(document_url)
-    if not text:
+def ingest_document(document_url, embeddings=None):
+    """
+    Download, chunk and index a document, then store it in the document cache.
+    Pass a loaded embeddings model to avoid loading a new one per document.
+    """
+    # Download and extract text page by page
+    pages = download_and_extract_pages(document_url)
+    if not pages or not any(pages):
         raise ValueError(f"Failed to extract text from document: {document_url}")
     
-    # Create document structure
-    documents = [{'id': document_url, 'text': text}]
-    
-    # Chunk the document
-    chunks = chunk_text(text) # This now returns a list of strings
-    chunked_documents = []
-    for i, chunk_text_content in enumerate(chunks):
-        chunked_documents.append({
-            'chunk_id': i,
-            'source_doc_id': document_url,
-            'text': chunk_text_content
-        })
+    # Chunk the document straight into the columnar chunk store
+    chunk_store = ChunkStore()
+    for i, chunk in enumerate(chunk_pages(pages)):
+        chunk_store.add(chunk.text, document_url, chunk_id=i, page=chunk.page, start=chunk.start, end=chunk.end)
         
-    # Create Annoy index for semantic search
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
-    raw_texts = [chunk['text'] for chunk in chunked_documents]
-    annoy_vector_store = Annoy.from_texts(raw_texts, embeddings)
-    annoy_vector_store.save_local(ANNOY_INDEX_FILE)
+    # Create Annoy index for semantic search; item ids are chunk store positions
+    annoy_index_file = annoy_index_path(document_url, chunk_store)
+    annoy_dim = build_annoy_index(list(chunk_store.iter_texts()), annoy_index_file, embeddings)
 
     data_to_return = {
-        "full_documents": documents,
-        "chunked_documents": chunked_documents,
-        "annoy_index_file": ANNOY_INDEX_FILE
+        "document_id": document_url,
+        "chunk_store": chunk_store,
+        "annoy_index_file": annoy_index_file,
+        "annoy_dim": annoy_dim,
+        "processed_at": datetime.now()
     }
     
     # Add LangChain compatibility flag
@@ -182,7 +246,61 @@ def process_new_document(document_url):
     
     # Cache the processed document
     cache_document(document_url, data_to_return)
+    return data_to_return
+
+def _refresh_document(document_url, stale_index_file, on_refresh, embeddings):
+    try:
+        data = ingest_document(document_url, embeddings)
+        print(f"Background refresh complete for {document_url}")
+        if on_refresh is not None:
+            on_refresh(document_url, data)
+        # Only once the fresh copy is swapped in; retrievers that already loaded the
+        # stale index keep their mapping after the unlink
+        if stale_index_file and stale_index_file != data['annoy_index_file'] and os.path.exists(stale_index_file):
+            os.remove(stale_index_file)
+    except Exception as e:
+        # Keep serving the stale copy; the next request schedules another attempt
+        print(f"Background refresh failed for {document_url}: {e}")
+    finally:
+        with _document_cache_lock:
+            _refreshing.discard(document_url)
+
+def schedule_document_refresh(document_url, stale_index_file=None, on_refresh=None, embeddings=None):
+    """
+    Re-ingest a document on the bounded background refresh pool.
+    At most one refresh per document is in flight; returns False if one already is.
+    """
+    global _refresh_executor
+    with _document_cache_lock:
+        if document_url in _refreshing:
+            return False
+        _refreshing.add(document_url)
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(max_workers=DOCUMENT_REFRESH_WORKERS,
+                                                   thread_name_prefix="document-refresh")
+    _refresh_executor.submit(_refresh_document, document_url, stale_index_file, on_refresh, embeddings)
+    return True
+
+def process_new_document(document_url, on_refresh=None, embeddings=None, refresh_stale=True):
+    """
+    Process a new document URL for immediate use.
+    A stale cached copy is returned straight away and refreshed in the background;
+    on_refresh(document_url, data) is called once the refreshed data is cached.
+    Callers that must put the stale copy in place before a refresh can replace it pass
+    refresh_stale=False and schedule the refresh themselves, going by 'processed_at'.
+    """
+    print(f"Processing new document: {document_url}")
+    
+    # Check cache first
+    cached_data, is_stale = lookup_cached_document(document_url)
+    if cached_data:
+        if is_stale and refresh_stale:
+            print(f"Cached document is stale, refreshing in background: {document_url}")
+            schedule_document_refresh(document_url, cached_data.get('annoy_index_file'), on_refresh, embeddings)
+        print(f"Loaded processed document from cache: {document_url}")
+        return cached_data
     
+    data_to_return = ingest_document(document_url, embeddings)
     print(f"Processing complete for new document.")
     return data_to_return
 
@@ -198,7 +316,7 @@ def initialize_and_preprocess(document_url=None):
         with open(PERSISTENCE_FILE, 'rb') as f:
             data = pickle.load(f)
         # Ensure backwards compatibility
-        if 'langchain_compatible' not in data:
+        if 'langchain_compatible' not in data or 'chunk_store' not in data:
             print("Updating data format for LangChain compatibility...")
             data = make_langchain_compatible(data)
             # Optionally, save the updated format back to disk
@@ -1,8 +1,10 @@
 import asyncio
+from collections import deque
 from google import genai
 from google.genai.types import GenerateContentConfig
 
-from config import LLM_MODEL_NAME, GEMINI_API_KEY
+from config import (LLM_MODEL_NAME, GEMINI_API_KEY, LLM_HEDGING_ENABLED, LLM_HEDGE_PERCENTILE,
+                    LLM_HEDGE_MAX_RATE, LLM_HEDGE_MIN_SAMPLES, LLM_HEDGE_WINDOW)
 
 # Configure synchronous client
 sync_client = genai.Client(api_key=GEMINI_API_KEY)
@@ -10,6 +12,78 @@ sync_client = genai.Client(api_key=GEMINI_API_KEY)
 # Configure asynchronous client (aio namespace)
 async_client = genai.Client(api_key=GEMINI_API_KEY)
 
+class RequestHedger:
+    """
+    Hedges slow async calls: if a call is still running after the tracked latency
+    percentile, an identical second call is started, the first result wins and the
+    other is cancelled. Hedges are capped at max_hedge_rate of recent calls.
+    """
+    def __init__(self, percentile=LLM_HEDGE_PERCENTILE, max_hedge_rate=LLM_HEDGE_MAX_RATE,
+                 min_samples=LLM_HEDGE_MIN_SAMPLES, window=LLM_HEDGE_WINDOW):
+        self.percentile = percentile
+        self.max_hedge_rate = max_hedge_rate
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)   # seconds, of completed calls
+        self.decisions = deque(maxlen=window)   # True where a hedge was issued
+
+    def hedge_delay(self):
+        """Current latency percentile, or None until enough calls have been observed."""
+        if not self.latencies or len(self.latencies) < self.min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
+
+    def hedge_rate(self):
+        return sum(self.decisions) / len(self.decisions) if self.decisions else 0.0
+
+    def _may_hedge(self):
+        return sum(self.decisions) + 1 <= self.max_hedge_rate * (len(self.decisions) + 1)
+
+    async def run(self, make_call):
+        """Await make_call(), hedging it with a second make_call() if it is slow."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        tasks = []
+
+        def record_primary(task):
+            # The primary call's own latency, not the hedged one the caller sees. A slow
+            # primary cancelled in favour of its hedge contributes the time it had run,
+            # a lower bound that still lands in the tail where it belongs.
+            if task.cancelled() or task.exception() is None:
+                self.latencies.append(loop.time() - started)
+
+        try:
+            primary = asyncio.ensure_future(make_call())
+            primary.add_done_callback(record_primary)
+            tasks.append(primary)
+
+            hedged = False
+            delay = self.hedge_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self._may_hedge():
+                    tasks.append(asyncio.ensure_future(make_call()))
+                    hedged = True
+            self.decisions.append(hedged)
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Cancel the losing (or, if we were cancelled, every) call
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+llm_hedger = RequestHedger()
+
 def get_llm_response_with_cache(query, relevant_cache_entries):
     """Blocking, synchronous generation using GenAI SDK."""
     if not relevant_cache_entries:
@@ -45,8 +119,12 @@ Answer:
     except Exception as e:
         return f"Error during generation: {e}"
 
-async def get_llm_response_async(query, relevant_entries):
-    """Non-blocking, async generation suitable for parallel requests."""
+async def get_llm_response_async(query, relevant_entries, client=None, raise_errors=False):
+    """
+    Non-blocking, async generation suitable for parallel requests.
+    With LLM_HEDGING_ENABLED, slow calls are hedged by llm_hedger. Generation errors
+    come back as an error string unless raise_errors is set.
+    """
     if not relevant_entries:
         return "No relevant knowledge found for the query."
 
@@ -69,16 +147,26 @@ Question: {query}
 
 Answer:
 """
-    try:
-        resp = await async_client.aio.models.generate_content(
+    client = client or async_client
+
+    def generate():
+        return client.aio.models.generate_content(
             model=LLM_MODEL_NAME,
             contents=prompt,
             config=GenerateContentConfig(max_output_tokens=500, temperature=0.2)
         )
+
+    try:
+        if LLM_HEDGING_ENABLED:
+            resp = await llm_hedger.run(generate)
+        else:
+            resp = await generate()
         return resp.text.strip()
     except Exception as e:
         # Use logging or print as appropriate in production
         print(f"Async generation error for query '{query}': {e}")
+        if raise_errors:
+            raise
         return f"Error during generation: {e}"
 
 # Example function to issue many async calls in parallel:
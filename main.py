@@ -1,8 +1,145 @@
 import os
+import json
+import argparse
+import asyncio
 from cag_engine import CAGEngine
 from cache_builder import build_cache, CACHE_FILE
+from config import BULK_CONCURRENCY, BULK_BATCH_SIZE
+
+def load_jobs(jobs_path):
+    """
+    Read (document, questions) jobs from a JSONL file. Each line looks like a
+    /hackrx/run request: {"id": ..., "documents": <url>, "questions": [...]}.
+    The id is optional and defaults to the line number.
+    """
+    jobs = []
+    with open(jobs_path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                print(f"Skipping line {line_number}: invalid JSON ({e}).")
+                continue
+            if not isinstance(job, dict) or not job.get('documents') or not isinstance(job.get('questions'), list):
+                print(f"Skipping line {line_number}: 'documents' and a list of 'questions' are required.")
+                continue
+            job['id'] = str(job.get('id', line_number))
+            jobs.append(job)
+    return jobs
+
+def compact_results(output_path):
+    """
+    The output file doubles as the checkpoint. Rewrite it with one line per job id,
+    keeping each job's latest result: a retried job appends a new line, and this
+    replaces its earlier error line. A torn last line from an interrupted run is
+    dropped. Returns the ids of jobs with a successful result.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    records = {}
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[str(record['id'])] = record
+    temp_path = output_path + ".tmp"
+    with open(temp_path, 'w') as f:
+        for record in records.values():
+            f.write(json.dumps(record) + "\n")
+    os.replace(temp_path, output_path)
+    return {job_id for job_id, record in records.items() if 'error' not in record}
+
+def _pack_batches(jobs, batch_size):
+    """Group consecutive jobs so each batch holds about batch_size questions."""
+    batch, size = [], 0
+    for job in jobs:
+        if batch and size + len(job['questions']) > batch_size:
+            yield batch
+            batch, size = [], 0
+        batch.append(job)
+        size += len(job['questions'])
+    if batch:
+        yield batch
+
+async def run_bulk(jobs_path, output_path, concurrency=BULK_CONCURRENCY, batch_size=BULK_BATCH_SIZE):
+    """
+    Answer every job in jobs_path and write one result line per job id to output_path.
+    Jobs are grouped by document so each document is ingested once; up to `concurrency`
+    documents are processed at a time, each in batches of about batch_size questions.
+    Jobs already answered in output_path are skipped, so an interrupted run resumes;
+    jobs that failed are retried and their new result replaces the old one.
+    """
+    jobs = load_jobs(jobs_path)
+    completed = compact_results(output_path)
+    pending = [job for job in jobs if job['id'] not in completed]
+    print(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already done, {len(pending)} to run.")
+    if not pending:
+        return
+
+    jobs_by_document = {}
+    for job in pending:
+        jobs_by_document.setdefault(job['documents'], []).append(job)
+
+    cag_engine = CAGEngine()
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = {'done': 0}
+
+    with open(output_path, 'a') as out:
+        def write_result(job, record):
+            out.write(json.dumps({'id': job['id'], 'documents': job['documents'], **record}) + "\n")
+            out.flush()
+            progress['done'] += 1
+
+        async def run_document(document_url, document_jobs):
+            async with semaphore:
+                try:
+                    retriever = await cag_engine.prepare_document(document_url)
+                except Exception as e:
+                    print(f"Error ingesting document {document_url}: {e}")
+                    for job in document_jobs:
+                        write_result(job, {'error': f"Error ingesting document: {e}"})
+                    return
+
+                for batch in _pack_batches(document_jobs, batch_size):
+                    questions = [question for job in batch for question in job['questions']]
+                    results = await cag_engine.generate_batch_answers(questions, retriever=retriever,
+                                                                      with_status=True)
+                    position = 0
+                    for job in batch:
+                        job_results = results[position:position + len(job['questions'])]
+                        position += len(job['questions'])
+                        record = {'answers': [
+                            {'question': question, 'answer': result['answer']}
+                            for question, result in zip(job['questions'], job_results)
+                        ]}
+                        if any(result['status'] != 'ok' for result in job_results):
+                            # Keep the partial answers, but leave the job to be retried on resume
+                            record['error'] = "Some questions failed to generate an answer."
+                        write_result(job, record)
+                    print(f"Completed {progress['done']}/{len(pending)} jobs")
+
+        await asyncio.gather(*(run_document(url, document_jobs) for url, document_jobs in jobs_by_document.items()))
+    # Drop the error lines of jobs that succeeded on this run
+    compact_results(output_path)
+    print(f"Bulk run complete. Results written to {output_path}.")
 
 def main():
+    parser = argparse.ArgumentParser(description="Cache-Augmented Generation (CAG) question answering.")
+    parser.add_argument("--document", help="Document URL to ask questions about in interactive mode")
+    parser.add_argument("--bulk", metavar="JOBS_JSONL", help="Answer the (document, questions) jobs in this JSONL file")
+    parser.add_argument("--output", default="results.jsonl", help="Bulk mode results file, one line per job id; also used to resume")
+    parser.add_argument("--concurrency", type=int, default=BULK_CONCURRENCY, help="Documents processed at once in bulk mode")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE, help="Questions per generation batch in bulk mode")
+    args = parser.parse_args()
+
+    if args.bulk:
+        asyncio.run(run_bulk(args.bulk, args.output, concurrency=args.concurrency, batch_size=args.batch_size))
+        return
+
     print("--- Cache-Augmented Generation (CAG) System ---")
 
     # Check if cache exists, build if not
@@ -26,6 +163,11 @@ def main():
         print(f"Unexpected error initializing CAG Engine: {e}")
         return
 
+    document_url = args.document or input("Document URL to ask questions about: ").strip()
+    if not document_url:
+        print("A document URL is required. Exiting.")
+        return
+
     print("\nCAG System is ready. You can now ask questions.")
     print("Commands: 'exit' to quit, 'report' for cache analytics, 'feedback <score>' for learning")
     
@@ -56,7 +198,7 @@ def main():
             continue
 
         print("\nProcessing query...")
-        answer = cag_engine.generate_answer(user_input)
+        answer = cag_engine.generate_answer(user_input, document_url)
 
         print("\n--- AI Assistant (CAG) ---")
         print(answer)
@@ -1,37 +1,51 @@
+import re
 import spacy
+import threading
+from cachetools import LRUCache
 from sklearn.feature_extraction.text import TfidfVectorizer
+from config import RETRIEVAL_PLANS
+
+# Question openers that usually ask for a single fact. Yes/no openers ("does", "is there")
+# are left out: they are mostly coverage questions phrased without a coverage keyword.
+FACTOID_OPENERS = ('what is', 'what are', 'who', 'when', 'where', 'which', 'how much', 'how many', 'how long')
+# Intents whose answers tend to be spread across several clauses of a document
+BROAD_INTENTS = ('coverage_inquiry', 'exclusion_inquiry')
 
 class QueryProcessor:
-    def __init__(self):
+    def __init__(self, cache_size=1024):
         # Load spaCy model for NLP
         try:
             self.nlp = spacy.load("en_core_web_sm")
         except:
             print("spaCy model not found. Install with: python -m spacy download en_core_web_sm")
             self.nlp = None
-            
+        # Per-query analysis (intent, enhanced terms, plan), shared across requests
+        self.analysis_cache = LRUCache(maxsize=cache_size)
+        self._cache_lock = threading.Lock()
+
+    def _important_terms(self, doc):
+        """Entities plus lemmas of content words, in order of appearance."""
+        terms = [ent.text for ent in doc.ents]
+        terms.extend(token.lemma_ for token in doc
+                     if not token.is_stop and token.pos_ in ['NOUN', 'VERB', 'ADJ'])
+        return terms
+
     def enhance_query(self, query):
         """Enhance query with synonyms and related terms"""
         enhanced_terms = [query]
-        
+
         if self.nlp:
             doc = self.nlp(query)
-            
-            # Extract entities and important terms
-            entities = [ent.text for ent in doc.ents]
-            enhanced_terms.extend(entities)
-            
-            # Add root words and lemmas
-            important_tokens = [token.lemma_ for token in doc 
-                              if not token.is_stop and token.pos_ in ['NOUN', 'VERB', 'ADJ']]
-            enhanced_terms.extend(important_tokens)
-            
+
+            # Extract entities, root words and lemmas
+            enhanced_terms.extend(self._important_terms(doc))
+
         return list(set(enhanced_terms))  # Remove duplicates
-        
+
     def detect_query_intent(self, query):
         """Detect the intent of the query for better routing"""
         query_lower = query.lower()
-        
+
         if any(word in query_lower for word in ['coverage', 'covered', 'include']):
             return 'coverage_inquiry'
         elif any(word in query_lower for word in ['claim', 'file', 'submit']):
@@ -41,4 +55,67 @@ class QueryProcessor:
         elif any(word in query_lower for word in ['exclusion', 'not covered', 'exclude']):
             return 'exclusion_inquiry'
         else:
-            return 'general_inquiry'
\ No newline at end of file
+            return 'general_inquiry'
+
+    def _choose_plan(self, query, intent, terms):
+        """Pick a retrieval profile from RETRIEVAL_PLANS for one query."""
+        query_lower = query.lower().strip()
+        if intent in BROAD_INTENTS or len(terms) > 8:
+            return 'deep'
+        if query_lower.startswith(FACTOID_OPENERS) and len(terms) <= 4:
+            return 'fast'
+        return 'standard'
+
+    def analyze_queries(self, queries):
+        """
+        Analyze a batch of queries: intent, enhanced terms and retrieval plan.
+        Uncached queries go through spaCy together with nlp.pipe; results are cached per query.
+        """
+        analyses = {}
+        with self._cache_lock:
+            for query in queries:
+                if query in self.analysis_cache:
+                    analyses[query] = self.analysis_cache[query]
+
+        missing = list(dict.fromkeys(query for query in queries if query not in analyses))
+        if missing:
+            if self.nlp:
+                term_lists = [self._important_terms(doc) for doc in self.nlp.pipe(missing)]
+            else:
+                term_lists = [[word for word in query.split() if len(word) > 3] for query in missing]
+
+            fresh = {}
+            for query, terms in zip(missing, term_lists):
+                terms = list(dict.fromkeys(terms))
+                intent = self.detect_query_intent(query)
+                plan_name = self._choose_plan(query, intent, terms)
+                fresh[query] = {
+                    'intent': intent,
+                    'enhanced_terms': terms,
+                    'plan_name': plan_name,
+                    'plan': dict(RETRIEVAL_PLANS[plan_name]),
+                }
+            analyses.update(fresh)
+            with self._cache_lock:
+                self.analysis_cache.update(fresh)
+
+        return [analyses[query] for query in queries]
+
+    def plan_queries(self, queries):
+        """
+        Return retriever keyword arguments for each query in the batch.
+        For plans that ask for expansion, enhanced terms whose words are not already
+        in the query are appended to the keyword (BM25) query only, so BM25 doesn't
+        count the query's own words twice.
+        """
+        plans = []
+        for query, analysis in zip(queries, self.analyze_queries(queries)):
+            plan = dict(analysis['plan'])
+            if plan.pop('expand_keywords', False):
+                query_words = set(re.findall(r"\w+", query.lower()))
+                new_terms = [term for term in analysis['enhanced_terms']
+                             if not set(re.findall(r"\w+", term.lower())) <= query_words]
+                if new_terms:
+                    plan['keyword_query'] = " ".join([query] + new_terms)
+            plans.append(plan)
+        return plans
@@ -1,113 +1,130 @@
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
 from langchain_core.documents import Document
-from langchain_core.retrievers import BaseRetriever
 from typing import List, Optional
+from annoy import AnnoyIndex
+from rank_bm25 import BM25Okapi
 from data_processor import preprocess
-from langchain_community.vectorstores import Annoy
 from langchain_huggingface import HuggingFaceEmbeddings
 from config import EMBEDDING_MODEL_NAME
+from chunk_store import ChunkStore
 from flashrank import Ranker, RerankRequest
+import heapq
 
-class AnnoyRetriever(BaseRetriever):
+def load_reranker():
+    """The cross-encoder used to rerank fused candidates; load once and share it."""
+    return Ranker(model_name="ms-marco-MiniLM-L-12-v2", cache_dir="/tmp/flashrank_cache")
+
+class BM25IdRetriever:
     """
-    Custom retriever that uses a pre-built Annoy index for semantic search.
-    The 'index' and 'k' fields are declared at the class level to comply with
-    LangChain's Pydantic-based BaseRetriever.
+    Keyword search over a ChunkStore using BM25.
+    Only the tokenized corpus is kept; results are chunk store positions.
     """
-    index: Annoy
-    k: int = 10
+    def __init__(self, chunk_store: ChunkStore, k: int = 10):
+        self.k = k
+        self.vectorizer = BM25Okapi([preprocess(text) for text in chunk_store.iter_texts()])
 
-    def _get_relevant_documents(self, query: str) -> List[Document]:
-        """
-        Get documents relevant to a query using the Annoy index for semantic search.
-        This method is called by the LangChain framework.
-        """
-        # The similarity_search method of the Annoy vector store performs the semantic search.
-        return self.index.similarity_search(query, k=self.k)
+    def search(self, query: str, k: Optional[int] = None) -> List[int]:
+        scores = self.vectorizer.get_scores(preprocess(query))
+        return heapq.nlargest(k or self.k, range(len(scores)), key=scores.__getitem__)
+
+class AnnoyRetriever:
+    """
+    Semantic search using a pre-built Annoy index whose item ids are chunk store positions.
+    """
+    def __init__(self, index_file: str, embeddings: HuggingFaceEmbeddings, dim: int, k: int = 10):
+        self.k = k
+        self.embeddings = embeddings
+        self.index = AnnoyIndex(dim, "angular")
+        self.index.load(index_file)
+
+    def search(self, query: str, k: Optional[int] = None) -> List[int]:
+        return self.index.get_nns_by_vector(self.embeddings.embed_query(query), k or self.k)
+
+def weighted_reciprocal_rank(ranked_lists, weights, c=60):
+    """
+    Fuse several ranked lists of chunk positions with weighted Reciprocal Rank Fusion,
+    the same scoring LangChain's EnsembleRetriever applies to documents.
+    """
+    scores = {}
+    for ranked, weight in zip(ranked_lists, weights):
+        for rank, position in enumerate(ranked, start=1):
+            scores[position] = scores.get(position, 0.0) + weight / (rank + c)
+    return sorted(scores, key=scores.__getitem__, reverse=True)
 
 class CAGHybridRetriever:
-    def __init__(self, processed_data):
+    def __init__(self, processed_data, embeddings: Optional[HuggingFaceEmbeddings] = None,
+                 reranker: Optional[Ranker] = None):
         """
         Initialize the hybrid retriever with your existing processed data.
         This retriever combines a keyword-based search (BM25) and a semantic search (Annoy).
+        The embeddings model and reranker are shared between retrievers when passed in;
+        otherwise each retriever loads its own.
         """
-        self.chunked_documents = processed_data['chunked_documents']
-        
+        self.chunk_store: ChunkStore = processed_data['chunk_store']
+        # Kept so the owner can tell when the data is stale and which index a refresh replaces
+        self.processed_at = processed_data.get('processed_at')
+        self.annoy_index_file = processed_data['annoy_index_file']
+
         # Initialize retrievers as class attributes
-        self.bm25_retriever: Optional[BM25Retriever] = None
+        self.bm25_retriever: Optional[BM25IdRetriever] = None
         self.annoy_retriever: Optional[AnnoyRetriever] = None
-        self.ensemble_retriever: Optional[EnsembleRetriever] = None
-        
-        # Convert to LangChain documents, which are required by the retrievers.
-        self.langchain_docs = [
-            Document(
-                page_content=doc['text'],
-                metadata={
-                    'chunk_id': doc['chunk_id'],
-                    'source_doc_id': doc['source_doc_id']
-                }
-            ) for doc in self.chunked_documents
-        ]
-        
-        # Initialize the individual retrievers and the ensemble retriever.
-        self._setup_retrievers(processed_data['annoy_index_file'])
-        self.reranker = Ranker(model_name="ms-marco-MiniLM-L-12-v2", cache_dir="/tmp/flashrank_cache")
-    
-    def _setup_retrievers(self, annoy_index_file):
+        # Weights for the keyword and semantic results in the hybrid fusion.
+        self.weights = [0.3, 0.7]
+
+        # Initialize the individual retrievers.
+        self._setup_retrievers(processed_data['annoy_index_file'], processed_data.get('annoy_dim'), embeddings)
+        self.reranker = reranker or load_reranker()
+
+    def _setup_retrievers(self, annoy_index_file, annoy_dim=None, embeddings=None):
         """
         Set up the BM25 (keyword) and Annoy (semantic) retrievers.
         """
         # 1. BM25 Retriever (Keyword-based search)
         # This retriever is good for finding documents with exact keyword matches.
-        self.bm25_retriever = BM25Retriever.from_documents(
-            self.langchain_docs,
-            k=10,
-            preprocess_func=preprocess
-        )
-        
+        self.bm25_retriever = BM25IdRetriever(self.chunk_store, k=10)
+
         # 2. Annoy Retriever (Semantic Search)
         # This retriever finds documents that are semantically similar to the query,
         # even if they don't contain the exact keywords.
-        
-        # Load the embeddings model. This is the same model used to create the Annoy index.
-        embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
-        
+
+        # Load the embeddings model unless one was passed in. This is the same model used to create the Annoy index.
+        if embeddings is None:
+            embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+        if annoy_dim is None:
+            annoy_dim = len(embeddings.embed_query(""))
+
         # Load the local Annoy index from the file created by data_processor.py.
-        # allow_dangerous_deserialization is needed to load the index from a pickle file.
-        annoy_index = Annoy.load_local(annoy_index_file, embeddings, allow_dangerous_deserialization=True)
-        
-        # Instantiate our custom AnnoyRetriever, which is a LangChain-compatible retriever.
-        self.annoy_retriever = AnnoyRetriever(index=annoy_index)
-        
-        # 3. Ensemble Retriever (Hybrid Search)
-        # This retriever combines the results from both the BM25 and Annoy retrievers.
-        # The 'weights' parameter controls the contribution of each retriever to the final score.
-        # Here, we are giving equal weight to both keyword and semantic search.
-        self.ensemble_retriever = EnsembleRetriever(
-            retrievers=[self.bm25_retriever, self.annoy_retriever],
-            weights=[0.3, 0.7] # You can tune these weights for better performance.
+        self.annoy_retriever = AnnoyRetriever(annoy_index_file, embeddings, annoy_dim, k=10)
+
+    def _to_document(self, position):
+        """Materialize a chunk store entry as a LangChain document."""
+        return Document(
+            page_content=self.chunk_store.text(position),
+            metadata=self.chunk_store.metadata(position)
         )
-    
-    def retrieve(self, query, top_k=5):
+
+    def retrieve(self, query, top_k=5, bm25_k=None, annoy_k=None, rerank=True, keyword_query=None):
         """
-        The main retrieval method. It uses the ensemble retriever to get the best of both
-        keyword and semantic search.
+        The main retrieval method. It fuses keyword and semantic search over chunk ids,
+        reranks the candidates and only builds documents for the final top_k.
+        The depth of each search, the rerank step and an expanded keyword query can be
+        set per call by the query planner.
         """
-        if self.ensemble_retriever is None:
-            raise ValueError("Ensemble retriever has not been initialized.")
-        
-        # The 'invoke' method of the ensemble retriever runs the query against both retrievers
-        # and combines the results based on the weights.
-        results = self.ensemble_retriever.invoke(query)
-
-        reranker_request = RerankRequest(query=query, 
-            passages=[{"id": i, "text": doc.page_content} for i, doc in enumerate(results)]
+        if self.bm25_retriever is None or self.annoy_retriever is None:
+            raise ValueError("Hybrid retriever has not been initialized.")
+
+        # Run the query against both retrievers and combine the results based on the weights.
+        candidates = weighted_reciprocal_rank(
+            [self.bm25_retriever.search(keyword_query or query, bm25_k),
+             self.annoy_retriever.search(query, annoy_k)],
+            self.weights
         )
-        
-        reranked_results = self.reranker.rerank(reranker_request)
-        final_docs = []
-        for result in reranked_results[:top_k]:
-             final_docs.append(results[result['id']])
 
-        return final_docs
\ No newline at end of file
+        if not rerank:
+            return [self._to_document(position) for position in candidates[:top_k]]
+
+        reranker_request = RerankRequest(query=query,
+            passages=[{"id": position, "text": self.chunk_store.text(position)} for position in candidates]
+        )
+
+        reranked_results = self.reranker.rerank(reranker_request)
+        return [self._to_document(result['id']) for result in reranked_results[:top_k]]
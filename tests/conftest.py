@@ -0,0 +1,6 @@
+import os
+import sys
+
+# config.py refuses to import without a key; the tests never reach the real API.
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
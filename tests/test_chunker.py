@@ -0,0 +1,92 @@
+import random
+
+import pytest
+
+from chunker import SEPARATORS, iter_chunks
+
+CHUNK_SIZE = 100
+OVERLAP = 20
+
+def random_pages(num_pages, seed=0):
+    """Pages of words, sentences and paragraphs, with some empty pages mixed in."""
+    rng = random.Random(seed)
+    words = "policy claim premium hospital benefit exclusion waiting period".split()
+    pages = []
+    for _ in range(num_pages):
+        if rng.random() < 0.2:
+            pages.append("")
+            continue
+        paragraphs = [" ".join(rng.choice(words) for _ in range(rng.randint(3, 40))) + "."
+                      for _ in range(rng.randint(1, 4))]
+        pages.append(rng.choice(["\n\n", "\n", " "]).join(paragraphs) + rng.choice(["", "\n"]))
+    return pages
+
+def test_chunks_match_their_offsets_and_size():
+    pages = random_pages(200)
+    full = "".join(pages)
+    chunks = list(iter_chunks(pages, CHUNK_SIZE, OVERLAP))
+
+    assert chunks
+    for chunk in chunks:
+        assert full[chunk.start:chunk.end] == chunk.text
+        assert 0 < len(chunk.text) <= CHUNK_SIZE
+        assert chunk.text == chunk.text.strip()
+
+def test_chunks_cover_all_text_in_order():
+    pages = random_pages(200, seed=1)
+    full = "".join(pages)
+    chunks = list(iter_chunks(pages, CHUNK_SIZE, OVERLAP))
+
+    assert chunks[0].start == len(full) - len(full.lstrip())
+    assert chunks[-1].end == len(full.rstrip())
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous.start < chunk.start
+        # Consecutive chunks overlap or are separated only by whitespace
+        assert full[previous.end:chunk.start].strip() == ""
+
+def test_overlap_is_whole_pieces_within_the_limit():
+    pages = random_pages(200, seed=2)
+    full = "".join(pages)
+    chunks = list(iter_chunks(pages, CHUNK_SIZE, OVERLAP))
+
+    for previous, chunk in zip(chunks, chunks[1:]):
+        if chunk.start < previous.end:
+            assert previous.end - chunk.start <= OVERLAP
+            # The repeated text starts right after a separator, not mid-word
+            assert any(full[:chunk.start].endswith(separator) for separator in SEPARATORS)
+
+def test_page_attribution_skips_empty_pages():
+    pages = ["", "first page text. " * 3, "", "", "second page text. " * 3, ""]
+    page_starts, offset = [], 0
+    for page in pages:
+        page_starts.append(offset)
+        offset += len(page)
+
+    for chunk in iter_chunks(pages, 40, 10):
+        page_index = chunk.page - 1
+        assert pages[page_index]
+        assert page_starts[page_index] <= chunk.start < page_starts[page_index] + len(pages[page_index])
+
+def test_page_boundaries_do_not_change_chunks():
+    pages = random_pages(100, seed=3)
+    paged = [chunk[:3] for chunk in iter_chunks(pages, CHUNK_SIZE, OVERLAP)]
+    whole = [chunk[:3] for chunk in iter_chunks(["".join(pages)], CHUNK_SIZE, OVERLAP)]
+    assert paged == whole
+
+def test_text_without_whitespace_terminates():
+    text = "x" * 1000
+    chunks = list(iter_chunks([text], CHUNK_SIZE, OVERLAP))
+
+    assert all(len(chunk.text) <= CHUNK_SIZE for chunk in chunks)
+    assert chunks[-1].end == len(text)
+    # Hard cuts overlap by exactly the overlap
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous.end - chunk.start == OVERLAP
+
+def test_whitespace_only_and_empty_input():
+    assert list(iter_chunks([], CHUNK_SIZE, OVERLAP)) == []
+    assert list(iter_chunks(["", "   \n\n  ", ""], CHUNK_SIZE, OVERLAP)) == []
+
+def test_overlap_must_be_smaller_than_chunk_size():
+    with pytest.raises(ValueError):
+        list(iter_chunks(["text"], 10, 10))
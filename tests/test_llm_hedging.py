@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+import llm_interface
+from benchmark import FakeGenAIClient
+from llm_interface import RequestHedger, get_llm_response_async
+
+ENTRIES = [{'text_snippet': "The waiting period is 30 days."}]
+
+def scripted(values):
+    """Sampler returning the given values in order, one per call."""
+    values = iter(values)
+    return lambda: next(values)
+
+@pytest.fixture
+def hedger(monkeypatch):
+    """
+    Enable hedging with a hedger primed with 20 unhedged 10 ms calls, so the next
+    call slower than 10 ms is hedged (the rate cap needs history to allow one).
+    """
+    hedger = RequestHedger(percentile=95, max_hedge_rate=0.1, min_samples=20, window=200)
+    hedger.latencies.extend([0.01] * 20)
+    hedger.decisions.extend([False] * 20)
+    monkeypatch.setattr(llm_interface, "LLM_HEDGING_ENABLED", True)
+    monkeypatch.setattr(llm_interface, "llm_hedger", hedger)
+    return hedger
+
+def test_slow_call_is_hedged_and_loser_cancelled(hedger):
+    client = FakeGenAIClient(scripted([0.5, 0.01]))
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        answer = await get_llm_response_async("What is the waiting period?", ENTRIES, client=client)
+        return answer, loop.time() - start
+
+    answer, elapsed = asyncio.run(run())
+
+    assert answer.startswith("answer from")
+    assert elapsed < 0.25
+    assert client.started == 2
+    assert client.completed == 1
+    assert client.cancelled == 1
+    assert list(hedger.decisions)[-1] is True
+
+def test_hedge_rate_stays_under_cap(hedger):
+    # Every call is slower than the hedge delay, so every call would hedge without the cap
+    client = FakeGenAIClient(lambda: 0.03)
+    num_requests = 100
+
+    async def run():
+        return await asyncio.gather(*(
+            get_llm_response_async(f"question {i}", ENTRIES, client=client) for i in range(num_requests)
+        ))
+
+    answers = asyncio.run(run())
+
+    assert all(answer.startswith("answer from") for answer in answers)
+    assert 0 < hedger.hedge_rate() <= hedger.max_hedge_rate
+    # Every extra call is a hedge, and hedges stay within the cap over the whole window
+    assert client.started - num_requests == sum(hedger.decisions)
+    assert sum(hedger.decisions) <= hedger.max_hedge_rate * len(hedger.decisions)
+
+def test_error_from_one_call_falls_back_to_the_other(hedger):
+    # The primary is slow enough to be hedged and then fails; the hedge succeeds
+    client = FakeGenAIClient(scripted([0.03, 0.03]), scripted([RuntimeError("boom"), None]))
+
+    answer = asyncio.run(get_llm_response_async("What is the waiting period?", ENTRIES, client=client))
+
+    assert answer.startswith("answer from")
+    assert client.started == 2
+    assert client.cancelled == 0
+
+def test_both_calls_failing_reports_error(hedger):
+    client = FakeGenAIClient(scripted([0.03, 0.03]), scripted([RuntimeError("first"), RuntimeError("second")]))
+
+    answer = asyncio.run(get_llm_response_async("What is the waiting period?", ENTRIES, client=client))
+
+    assert answer.startswith("Error during generation")
+
+def test_no_hedging_before_min_samples():
+    hedger = RequestHedger(min_samples=0)
+    client = FakeGenAIClient(lambda: 0.01)
+
+    async def run():
+        return await hedger.run(lambda: client.aio.models.generate_content(model="fake"))
+
+    asyncio.run(run())
+
+    assert client.started == 1
+    assert list(hedger.decisions) == [False]
+
+def test_tracks_primary_latency_not_hedged_latency():
+    hedger = RequestHedger(percentile=95, max_hedge_rate=1.0, min_samples=20, window=200)
+    hedger.latencies.extend([0.01] * 20)
+    client = FakeGenAIClient(scripted([0.2, 0.01]))
+
+    async def run():
+        return await hedger.run(lambda: client.aio.models.generate_content(model="fake"))
+
+    asyncio.run(run())
+
+    # The hedge answered after ~20 ms, but the slow primary had run longer than that
+    # when it was cancelled, and that is what the percentile tracks.
+    assert client.cancelled == 1
+    assert hedger.latencies[-1] >= 0.015